@@ -33,6 +33,14 @@ if _chat_pairs_raw:
 # 2. COMMAND MODE: In ANY chat, reply "stt" or "Stt" to a voice message to process it in that chat
 AUTO_PROCESS = True  # Set to False to disable automatic processing of source chats
 TRANSCRIBE_COMMAND = "stt"  # Command to trigger transcription (case-insensitive)
+BATCH_WINDOW_SECONDS = 5.0  # Debounce window for batching a burst of voice messages from one sender
+
+# Transcriptions shorter than this many words are sent as-is instead of paying
+# for an LLM summarization call — the raw text already is the summary
+SUMMARY_MIN_WORDS = int(os.getenv("SUMMARY_MIN_WORDS", "30"))
+
+# Maximum concurrent Groq API requests; size this to your Groq tier's rate limit
+GROQ_CONCURRENCY = int(os.getenv("GROQ_CONCURRENCY", "4"))
 
 # Command Mode Whitelist
 # Comma-separated list of Telegram user IDs allowed to use the transcribe command
@@ -9,6 +9,9 @@ import config
 # how far back to look (last week)
 CUTOFF = datetime.now(timezone.utc) - timedelta(days=7)
 
+# how many get_messages calls to run concurrently
+BATCH_SIZE = 20
+
 async def list_recent_chats():
     # Use StringSession if SESSION_STRING is set, otherwise use file-based session
     if config.SESSION_STRING:
@@ -19,14 +22,21 @@ async def list_recent_chats():
     async with client:
         seen_chats = set()
 
-        async for dialog in client.iter_dialogs():
-            messages = await client.get_messages(dialog.id, limit=1)
-            if messages and messages[0].date >= CUTOFF:
-                name = dialog.name or "(no name)"
-                username = getattr(dialog.entity, "username", None)
-                identifier = f"@{username}" if username else dialog.id
-                print(f"- {name} — {identifier}")
-                seen_chats.add(identifier)
+        # fetch the last message of each dialog concurrently, in batches,
+        # instead of one round-trip per dialog
+        dialogs = [dialog async for dialog in client.iter_dialogs()]
+        for i in range(0, len(dialogs), BATCH_SIZE):
+            batch = dialogs[i:i + BATCH_SIZE]
+            results = await asyncio.gather(
+                *[client.get_messages(dialog.id, limit=1) for dialog in batch]
+            )
+            for dialog, messages in zip(batch, results):
+                if messages and messages[0].date >= CUTOFF:
+                    name = dialog.name or "(no name)"
+                    username = getattr(dialog.entity, "username", None)
+                    identifier = f"@{username}" if username else dialog.id
+                    print(f"- {name} — {identifier}")
+                    seen_chats.add(identifier)
 
         if not seen_chats:
             print("No chats active today.")
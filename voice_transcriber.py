@@ -1,11 +1,17 @@
 import asyncio
 import datetime
+import gzip
+import hashlib
+import io
+import json
 import logging
-import os
+import re
 import sys
+from collections import OrderedDict
 
-import requests
-from dotenv import load_dotenv
+import aiohttp
+import diskcache
+import orjson
 from telethon import TelegramClient, events
 from telethon.sessions import StringSession
 
@@ -21,32 +27,155 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+# Track processed messages to avoid duplicates.
+# Bounded LRU (OrderedDict) so memory stays flat on long-running deployments,
+# persisted to disk so restarts don't redo work.
+PROCESSED_MESSAGES_MAX = 10_000
+PROCESSED_IDS_FILE = "processed_messages.json"
 
-# Track processed messages to avoid duplicates
-processed_messages = set()
+
+def _load_processed():
+    """Load the persisted dedup cache, or start empty if the file is missing/corrupt."""
+    try:
+        with open(PROCESSED_IDS_FILE) as f:
+            ids = json.load(f)
+    except (OSError, ValueError):
+        return OrderedDict()
+    return OrderedDict((message_id, True) for message_id in ids[-PROCESSED_MESSAGES_MAX:])
+
+
+processed_messages = _load_processed()
 start_time = datetime.datetime.now(datetime.timezone.utc)
+# Cached float timestamp for the per-event freshness check; comparing floats
+# avoids datetime/tzinfo work on the dispatch hot path
+start_ts = start_time.timestamp()
+
 
+# Pre-compiled matcher for the transcribe command so Telethon's dispatcher can
+# reject non-matching messages before the handler runs
+CMD_PATTERN = re.compile(rf"^\s*{re.escape(config.TRANSCRIBE_COMMAND)}\s*$", re.IGNORECASE)
 
-async def transcribe_audio(audio_file_path):
-    """Transcribe audio file using Groq STT model."""
+# Constant system prompt for summarization; the transcription goes in the user
+# message, so no per-call prompt string is assembled
+SUMMARY_SYSTEM_PROMPT = (
+    "Summarize the text provided by the user into a clear, concise bullet-point list. "
+    "The summary should be in the same language as the original text. "
+    "If the text contains just a few words, return the text as is. "
+    "If several labeled messages are provided, return a separate bullet-point list "
+    "per message under its label. "
+    "Provide the summary as a bullet-point list."
+)
+
+# Gzip the chat-completions body only for long transcriptions; for short notes
+# the compression overhead outweighs the bytes saved on the wire
+GZIP_MIN_CHARS = 2048
+
+# Telegram caps media captions at 1024 characters (plain messages allow 4096)
+CAPTION_MAX_CHARS = 1024
+
+
+def mark_processed(message_id):
+    """Record a message id in the bounded dedup cache, evicting the oldest entries."""
+    processed_messages[message_id] = True
+    processed_messages.move_to_end(message_id)
+    while len(processed_messages) > PROCESSED_MESSAGES_MAX:
+        processed_messages.popitem(last=False)
     try:
-        headers = {"Authorization": f"Bearer {config.GROQ_API_KEY}"}
-        
-        with open(audio_file_path, "rb") as audio_file:
-            files = {
-                "file": (os.path.basename(audio_file_path), audio_file, "audio/ogg"),
-                "model": (None, config.GROQ_STT_MODEL),
-                "response_format": (None, "text")
-            }
-            response = requests.post(
-                f"{config.GROQ_BASE_URL}/audio/transcriptions",
-                headers=headers,
-                files=files,
-                timeout=120
-            )
+        with open(PROCESSED_IDS_FILE, "w") as f:
+            json.dump(list(processed_messages), f)
+    except OSError as e:
+        logger.warning(f"Could not persist processed message ids: {e}")
+
+# Shared aiohttp session for Groq API calls, created in main() so it binds to the
+# running event loop. Keep-alive reuses TCP/TLS connections across calls.
+http_session = None
+
+# Cap concurrent Groq requests so bursts of voice messages don't hammer the API.
+# Only the API calls hold the semaphore, so queued messages keep downloading
+# (prefetching) while earlier ones are being transcribed or summarized.
+groq_semaphore = asyncio.Semaphore(config.GROQ_CONCURRENCY)
+
+# Keep strong references to in-flight background tasks so they aren't GC'd
+background_tasks = set()
+
+# Transcriptions waiting to be summarized, keyed by (destination_chat_id, sender_id).
+# A burst of voice messages from one sender is summarized with a single LLM call.
+pending_batches = {}
+
+# Persistent cache of Groq results keyed by content hash, so forwarded/replayed
+# voice messages and restarts don't pay for the same STT/LLM call twice
+groq_cache = diskcache.Cache("./cache")
+
+
+def content_hash(data):
+    """Short stable hash of audio bytes or text used as a cache key."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# Retry transient Groq failures with exponential backoff instead of giving up
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+def spawn_task(coro):
+    """Schedule a coroutine as a background task and keep a reference to it."""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def groq_post(url, build_request):
+    """POST to the Groq API, retrying transient errors with exponential backoff.
+
+    build_request is called once per attempt to produce fresh aiohttp kwargs,
+    since a multipart form body can't be re-sent after being consumed.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            response = await http_session.post(url, **build_request())
+            if response.status in RETRYABLE_STATUSES and attempt < MAX_RETRIES:
+                retry_after = response.headers.get("Retry-After")
+                response.release()
+                delay = RETRY_BACKOFF_SECONDS * (2 ** attempt)
+                # Honor the server's Retry-After hint on 429s when it's longer
+                # than our own backoff
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                logger.warning(f"Groq returned {response.status}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
             response.raise_for_status()
-            return response.text
+            return response
+        except aiohttp.ClientConnectionError as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            delay = RETRY_BACKOFF_SECONDS * (2 ** attempt)
+            logger.warning(f"Groq connection error ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def transcribe_audio(audio_buffer, filename="voice.ogg"):
+    """Transcribe an in-memory audio buffer using Groq STT model."""
+    try:
+        def build_request():
+            audio_buffer.seek(0)
+            form = aiohttp.FormData()
+            form.add_field("file", audio_buffer, filename=filename, content_type="audio/ogg")
+            form.add_field("model", config.GROQ_STT_MODEL)
+            form.add_field("response_format", "text")
+            return {"data": form}
+
+        async with groq_semaphore:
+            response = await groq_post(f"{config.GROQ_BASE_URL}/audio/transcriptions", build_request)
+            async with response:
+                return await response.text()
     except Exception as e:
         logger.error(f"Transcription error: {e}")
         return None
@@ -54,27 +183,37 @@ async def transcribe_audio(audio_file_path):
 
 async def summarize_text(text):
     """Summarize text to bullet-point list using Groq LLM."""
-    prompt = f"""Summarize the following text into a clear, concise bullet-point list. The summary should be in the same language as the original text. If the text contains just a few words, return the text as is.
+    # Cached by text content hash, so retries and replays skip the LLM call
+    cache_key = f"summary:{content_hash(text)}"
+    cached = groq_cache.get(cache_key)
+    if cached:
+        return cached
 
-{text}
-
-Provide the summary as a bullet-point list."""
-    
     try:
-        headers = {"Authorization": f"Bearer {config.GROQ_API_KEY}", "Content-Type": "application/json"}
         payload = {
             "model": config.GROQ_MODEL,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": [
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": text}
+            ],
             "temperature": 0
         }
-        response = requests.post(
-            f"{config.GROQ_BASE_URL}/chat/completions",
-            json=payload,
-            headers=headers,
-            timeout=120
-        )
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        body = orjson.dumps(payload)
+        headers = {"Content-Type": "application/json"}
+        if len(text) >= GZIP_MIN_CHARS:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        async with groq_semaphore:
+            response = await groq_post(
+                f"{config.GROQ_BASE_URL}/chat/completions",
+                lambda: {"data": body, "headers": headers}
+            )
+            async with response:
+                data = orjson.loads(await response.read())
+                summary = data["choices"][0]["message"]["content"]
+                groq_cache.set(cache_key, summary)
+                return summary
     except Exception as e:
         logger.error(f"Summarization error: {e}")
         return None
@@ -94,63 +233,125 @@ async def process_voice_message(client, voice_msg, destination_chat_id, forward_
         if voice_msg.id in processed_messages:
             logger.info(f"Message {voice_msg.id} already processed, skipping")
             return
-        
-        # Download voice message
-        audio_path = f"temp_voice_{voice_msg.id}.ogg"
-        await voice_msg.download_media(file=audio_path)
-        
-        logger.info(f"📥 Downloaded voice message {voice_msg.id}")
-        
-        # Transcribe
-        transcription = await transcribe_audio(audio_path)
+
+        # Check if already queued for summarization in a debounce window
+        if any(msg.id == voice_msg.id for queued in pending_batches.values() for msg, _ in queued):
+            logger.info(f"Message {voice_msg.id} already queued for summarization, skipping")
+            return
+
+        await _process_voice_message(client, voice_msg, destination_chat_id, forward_voice)
+    except Exception as e:
+        logger.error(f"Error processing voice message: {e}", exc_info=True)
+
+
+async def _process_voice_message(client, voice_msg, destination_chat_id, forward_voice):
+    """Do the actual download/transcribe/summarize/send work for one voice message."""
+    # Download voice message into memory (no temp file on disk)
+    audio_buffer = io.BytesIO()
+    await voice_msg.download_media(file=audio_buffer)
+    audio_buffer.seek(0)
+
+    logger.info(f"📥 Downloaded voice message {voice_msg.id}")
+
+    # Transcribe (cached by audio content hash, so forwards/replays are free)
+    cache_key = f"transcription:{content_hash(audio_buffer.getvalue())}"
+    transcription = groq_cache.get(cache_key)
+    if transcription:
+        logger.info(f"♻️ Transcription cache hit for message {voice_msg.id}")
+    else:
+        transcription = await transcribe_audio(audio_buffer, filename=f"voice_{voice_msg.id}.ogg")
         if not transcription:
             logger.error(f"Failed to transcribe voice message {voice_msg.id}")
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
             return
-        
-        logger.info(f"✍️ Transcribed: {transcription[:100]}...")
-        
-        # Summarize
-        summary = await summarize_text(transcription)
-        if not summary:
-            logger.error(f"Failed to summarize transcription for message {voice_msg.id}")
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-            return
-        
-        logger.info(f"📝 Summary created")
-        
-        # Send summary to destination chat
-        await client.send_message(
-            destination_chat_id,
-            f"🎤 **Voice Message Summary:**\n\n{summary}"
+        groq_cache.set(cache_key, transcription)
+
+    logger.info(f"✍️ Transcribed: {transcription[:100]}...")
+
+    # Queue the transcription for batched summarization; the first item in a
+    # batch schedules a flush after the debounce window
+    key = (destination_chat_id, voice_msg.sender_id)
+    batch = pending_batches.setdefault(key, [])
+    batch.append((voice_msg, transcription))
+    if len(batch) == 1:
+        loop = asyncio.get_running_loop()
+        loop.call_later(
+            config.BATCH_WINDOW_SECONDS,
+            lambda: spawn_task(flush_batch(client, key, destination_chat_id, forward_voice))
         )
-        
-        # Forward the original voice message (if configured)
-        if forward_voice:
-            await client.forward_messages(
+
+
+async def flush_batch(client, key, destination_chat_id, forward_voice):
+    """Summarize every transcription queued under one key with a single LLM call."""
+    try:
+        batch = pending_batches.pop(key, [])
+        if not batch:
+            return
+
+        voice_msgs = [msg for msg, _ in batch]
+        if len(batch) == 1:
+            combined = batch[0][1]
+        else:
+            # Label each transcription so the single LLM call returns one
+            # bullet list per message instead of blending them together
+            combined = "\n\n".join(
+                f"Message {i}:\n{transcription}"
+                for i, (_, transcription) in enumerate(batch, start=1)
+            )
+
+        # Forwarding doesn't depend on the summary, so let it run while the LLM
+        # works. Single-message batches skip this: the voice is re-sent with the
+        # summary as its caption in one round trip instead.
+        forward_task = None
+        if forward_voice and len(batch) > 1:
+            forward_task = spawn_task(client.forward_messages(destination_chat_id, voice_msgs))
+
+        # Short transcriptions are already their own summary — skip the LLM call
+        if len(combined.split()) < config.SUMMARY_MIN_WORDS:
+            summary = combined
+            logger.info(f"⏩ Transcription under {config.SUMMARY_MIN_WORDS} words, skipping summarization")
+        else:
+            summary = await summarize_text(combined)
+            if not summary:
+                logger.error(f"Failed to summarize batch of {len(batch)} message(s) for chat {destination_chat_id}")
+                return
+            logger.info(f"📝 Summary created for {len(batch)} message(s)")
+
+        # Send summary to destination chat; for a single forwarded voice the
+        # summary rides along as the caption, halving Telegram API calls —
+        # unless it would exceed the caption limit, where only the two-call
+        # path can deliver the full text
+        summary_text = f"🎤 **Voice Message Summary:**\n\n{summary}"
+        if forward_voice and len(batch) == 1 and len(summary_text) <= CAPTION_MAX_CHARS:
+            await client.send_file(
                 destination_chat_id,
-                voice_msg
+                file=voice_msgs[0].media,
+                caption=summary_text,
+                voice_note=True
             )
-        
-        logger.info(f"✅ Processed and sent voice message {voice_msg.id} to chat {destination_chat_id}")
-        
-        # Clean up temporary file
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
-        
-        # Mark as processed
-        processed_messages.add(voice_msg.id)
-        
+        else:
+            await client.send_message(destination_chat_id, summary_text)
+            if forward_voice and forward_task is None and len(batch) == 1:
+                await client.forward_messages(destination_chat_id, voice_msgs)
+
+        if forward_task is not None:
+            await forward_task
+
+        # Mark as processed only now that the summary is delivered; on any
+        # failure above the ids stay unmarked so a manual 'stt' retry works
+        # (cached transcriptions/summaries make that retry cheap)
+        for msg in voice_msgs:
+            mark_processed(msg.id)
+
+        logger.info(f"✅ Sent summary for {len(batch)} voice message(s) to chat {destination_chat_id}")
+
     except Exception as e:
-        logger.error(f"Error processing voice message: {e}", exc_info=True)
-        if 'audio_path' in locals() and os.path.exists(audio_path):
-            os.remove(audio_path)
+        logger.error(f"Error flushing summary batch: {e}", exc_info=True)
 
 
 async def main():
     """Main function to run the voice transcriber bot."""
+    global http_session
+
     logger.info("🚀 Starting Voice Transcriber Bot...")
     logger.info(f"📅 Start time: {start_time.strftime('%Y-%m-%d %H:%M:%S UTC')}")
     logger.info("📊 DUAL MODE: AUTO + COMMAND modes enabled")
@@ -167,13 +368,30 @@ async def main():
     
     # Initialize Telegram client
     # Use StringSession if SESSION_STRING is set (for Heroku), otherwise use file-based session
+    # Reconnect automatically on transient drops so a network blip doesn't force
+    # a full re-auth, and sleep through short flood waits instead of crashing
+    client_kwargs = {
+        "connection_retries": None,
+        "auto_reconnect": True,
+        "retry_delay": 1,
+        "flood_sleep_threshold": 60,
+    }
     if config.SESSION_STRING:
         logger.info("🔐 Using session string from environment variable")
-        client = TelegramClient(StringSession(config.SESSION_STRING), config.API_ID, config.API_HASH)
+        client = TelegramClient(StringSession(config.SESSION_STRING), config.API_ID, config.API_HASH, **client_kwargs)
     else:
         logger.info("📁 Using session file")
-        client = TelegramClient(config.SESSION_NAME, config.API_ID, config.API_HASH)
+        client = TelegramClient(config.SESSION_NAME, config.API_ID, config.API_HASH, **client_kwargs)
     
+    # Create the shared Groq HTTP session on the running loop; the pool limit
+    # matches the semaphore so requests never queue inside the connector
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=config.GROQ_CONCURRENCY, keepalive_timeout=60),
+        headers={"Authorization": f"Bearer {config.GROQ_API_KEY}"},
+        # Fail fast on stuck connections instead of burning the full read budget
+        timeout=aiohttp.ClientTimeout(connect=5, total=125)
+    )
+
     await client.start()
     logger.info("✅ Connected to Telegram")
     
@@ -184,17 +402,17 @@ async def main():
         @client.on(events.NewMessage(chats=list(config.CHAT_PAIRS.keys())))
         async def handle_auto_mode(event):
             """Handle new voice messages in source chats automatically."""
-            if event.message.voice and event.message.date > start_time:
+            if event.message.voice and event.message.date.timestamp() > start_ts:
                 destination_chat_id = config.CHAT_PAIRS.get(event.chat_id)
                 if destination_chat_id is None:
                     return
                 logger.info(f"🎤 [AUTO] New voice message detected: {event.message.id}")
-                await process_voice_message(
+                spawn_task(process_voice_message(
                     client,
                     event.message,
                     destination_chat_id,
                     forward_voice=config.FORWARD_VOICE_MESSAGE
-                )
+                ))
 
         logger.info("👂 [AUTO] Listening for voice messages in source chats...")
     elif config.AUTO_PROCESS and not config.CHAT_PAIRS:
@@ -205,53 +423,52 @@ async def main():
     # COMMAND MODE: Listen for "stt"/"Stt" replies to voice messages in ANY chat
     logger.info(f"⌨️ COMMAND MODE: Enabled in ALL chats")
     
-    @client.on(events.NewMessage())
+    @client.on(events.NewMessage(pattern=CMD_PATTERN, func=lambda e: bool(e.message.reply_to_msg_id)))
     async def handle_command_mode(event):
         """Handle 'stt' command replies to voice messages in any chat."""
-        # Check if message is a reply and contains the command
-        if (event.message.reply_to_msg_id and 
-            event.message.message and 
-            event.message.message.lower().strip() == config.TRANSCRIBE_COMMAND.lower()):
-            
-            logger.info(f"🎯 [COMMAND] '{config.TRANSCRIBE_COMMAND}' command detected from user {event.sender_id} in chat {event.chat_id}")
-            
-            # Check if user is authorized (whitelist active and user not in it)
-            if config.ALLOWED_USERS is not None and str(event.sender_id) not in config.ALLOWED_USERS:
-                logger.warning(f"🚫 [COMMAND] Unauthorized user {event.sender_id} attempted to use command")
-                # await event.reply("⛔ You are not authorized to use this command.")
-                return
+        # The event filter already matched the command text and required a reply
+        logger.info(f"🎯 [COMMAND] '{config.TRANSCRIBE_COMMAND}' command detected from user {event.sender_id} in chat {event.chat_id}")
+        
+        # Check if user is authorized (whitelist active and user not in it)
+        if config.ALLOWED_USERS is not None and str(event.sender_id) not in config.ALLOWED_USERS:
+            logger.warning(f"🚫 [COMMAND] Unauthorized user {event.sender_id} attempted to use command")
+            # await event.reply("⛔ You are not authorized to use this command.")
+            return
 
-            logger.info(f"✅ [COMMAND] User {event.sender_id} authorized")
+        logger.info(f"✅ [COMMAND] User {event.sender_id} authorized")
+        
+        # Get the replied-to message
+        try:
+            replied_msg = await event.message.get_reply_message()
             
-            # Get the replied-to message
-            try:
-                replied_msg = await event.message.get_reply_message()
+            # Check if the replied message is a voice message
+            if replied_msg and replied_msg.voice:
+                logger.info(f"🎤 [COMMAND] Processing voice message {replied_msg.id}")
                 
-                # Check if the replied message is a voice message
-                if replied_msg and replied_msg.voice:
-                    logger.info(f"🎤 [COMMAND] Processing voice message {replied_msg.id}")
-                    
-                    # Process the voice message and send summary to the same chat
-                    await process_voice_message(
-                        client,
-                        replied_msg,
-                        event.chat_id,  # Send to the same chat
-                        forward_voice=False  # Don't forward in command mode
-                    )
-                else:
-                    # Reply that the command must be used on a voice message
-                    await event.reply("⚠️ Please reply to a voice message with 'stt' to transcribe it.")
-                    logger.info(f"[COMMAND] '{config.TRANSCRIBE_COMMAND}' used on non-voice message")
-                    
-            except Exception as e:
-                logger.error(f"Error handling command mode: {e}", exc_info=True)
-                await event.reply("❌ Error processing voice message.")
+                # Process the voice message and send summary to the same chat
+                spawn_task(process_voice_message(
+                    client,
+                    replied_msg,
+                    event.chat_id,  # Send to the same chat
+                    forward_voice=False  # Don't forward in command mode
+                ))
+            else:
+                # Reply that the command must be used on a voice message
+                await event.reply("⚠️ Please reply to a voice message with 'stt' to transcribe it.")
+                logger.info(f"[COMMAND] '{config.TRANSCRIBE_COMMAND}' used on non-voice message")
+                
+        except Exception as e:
+            logger.error(f"Error handling command mode: {e}", exc_info=True)
+            await event.reply("❌ Error processing voice message.")
     
     logger.info(f"👂 [COMMAND] Listening for '{config.TRANSCRIBE_COMMAND}' replies to voice messages...")
     
     # Keep the bot running
     logger.info("✅ Bot is now running. Press Ctrl+C to stop.")
-    await client.run_until_disconnected()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        await http_session.close()
 
 
 if __name__ == "__main__":